@@ -1,221 +1,393 @@
+from __future__ import annotations
+
 import re
 import json
-from js import console
+import string
+import functools
+import collections
+import sys
+from typing import TYPE_CHECKING, Callable
+try:
+    from js import console  # type: ignore[import-not-found]
+except ImportError:  # Outside Pyodide, e.g. when profiling or compiling natively
+    console = None
+
+if TYPE_CHECKING:
+    from bibtexparser.bibdatabase import BibDatabase  # type: ignore[import-untyped]
+
+# Patterns are compiled once at import; the citation handlers run once per match
+_PUNCT_RE = re.compile(r'[^\w\s]')
+# One reference per line: authors, the first "(Year)" on the line, then the
+# title up to the next period. Lines are split at the same breaks as
+# str.splitlines so the whole list is parsed by a single finditer.
+_LINE_BREAKS = '\n\r\x0b\x0c\x1c-\x1e\x85\u2028\u2029'
+_REF_LINE_RE = re.compile(
+    rf'(?:^|(?<=[{_LINE_BREAKS}]))(?P<authors>[^{_LINE_BREAKS}]*?)'
+    rf'\((?P<year>\d{{4}}[a-z]?)\)\.?(?P<title>[^.{_LINE_BREAKS}]*)[^{_LINE_BREAKS}]*',
+    re.MULTILINE,
+)
+_CITE_TRAIL_RE = re.compile(r',\s*\d{4}[a-z]?$')
+_CITE_RE = re.compile(r'^(.*?),\s*(\d{4}[a-z]?)$')
+_SPLIT_AUTHORS_RE = re.compile(r',| & | \\& | and ')
+_FIRST_AUTHOR_SEP_RE = re.compile(r',|&| and ')
+# Textual citations (Author (Year)) and parenthetical citations
+# ((Author, Year; Author2, Year)) are found in a single scan. Parenthetical
+# content may not contain '(' so a textual citation nested inside one is
+# still reached by the textual branch, and must contain a year so the
+# handler is never called for math, figure references or enumerations.
+# The lookahead checks that the parenthesis closes before the year search
+# starts; without it an unclosed '(' before a long run of years is retried
+# from every year to the end of the text.
+# A textual citation can only start at the first word of a run of author
+# characters: if that start fails, every later start in the run fails too.
+# The lookbehind rejects the other starts at once, instead of re-walking the
+# rest of the run from each word, which made long sentences quadratic. The
+# separators in front of the first word are kept in 'lead'.
+# Bare ' & ' is matched by the same scan so it can be escaped for LaTeX
+# without another pass over the document.
+_CITATION_RE = re.compile(
+    r'(?<![\w\s,&])(?P<lead>[\s,&]*)'
+    r'(?P<authors>\b[\w\s,&]+?(?:\s+et al\.?)?)\s+\((?P<year>\d{4}[a-z]?)\)'
+    r'|\((?=[^()]*\))(?P<paren>[^()]*?\d{4}[a-z]?[^()]*)\)'
+    r'|(?P<amp> & )'
+)
+
+# ASCII punctuation and curly quotes become spaces in a single pass; '_' is a
+# word character for _PUNCT_RE, so it is kept. Other non-ASCII punctuation is
+# left to the regex fallback in normalize_title.
+_TITLE_TRANS = str.maketrans(
+    {c: ' ' for c in string.punctuation if c != '_'} | {'\u2019': ' ', '\u2018': ' '}
+)
+_BRACE_STRIP = str.maketrans('', '', '{}')
+
+# A reference-list line parsed once, with its normalized title kept so the
+# BibTeX lookup does not have to parse the line again
+ParsedRef = collections.namedtuple('ParsedRef', 'first_author year title line')
 
-def normalize_title(title):
+# Normalized BibTeX title -> ID for exact lookups, and the same titles with
+# spaces removed -> (ID, title) for the fallback, so titles whose words are
+# split differently still meet. A compact title shared by two different
+# titles maps to None.
+TitleIndex = collections.namedtuple('TitleIndex', 'by_title by_compact')
+
+_NO_CONVERSIONS_MESSAGE = "⚠️ No citations were converted. Please check your input formats"
+
+# Interning a probe key costs a lookup of its own, so only do it for indexes
+# big enough to be probed many times
+_INTERN_PROBE_MIN = 256
+
+def normalize_title(title: str) -> str:
     """Normalize titles for matching"""
     if not title:
         return ""
-    title = title.lower()
-    title = re.sub(r'[’‘]', "'", title)
-    title = re.sub(r'[^\w\s]', ' ', title)
-    title = re.sub(r'\s+', ' ', title).strip()
-    return title
-
-def parse_reference(reference_line):
-    """Parse reference line into components"""
-    if not reference_line:
-        return ['Author Not Found', 'Year Not Found', 'Title Not Found']
-    
-    try:
-        year_match = re.search(r'\((\d{4}[a-z]?)\)\.?', reference_line)
-        if not year_match:
-            return ['Author Not Found', 'Year Not Found', 'Title Not Found']
-        
-        year = year_match.group(1)
-        authors_part = reference_line[:year_match.start()].strip()
-        title_part = reference_line[year_match.end():].split('.', 1)[0].strip()
-        normalized_title = normalize_title(title_part)
-        return [authors_part, year, normalized_title]
-    
-    except (IndexError, AttributeError):
-        return ['Author Not Found', 'Year Not Found', 'Title Not Found']
-
-def get_reference_key(reference_line, bib_database):
-    """Find BibTeX key for a reference line"""
-    if not reference_line:
-        return None
-        
-    parsed_ref = parse_reference(reference_line)
-    if not parsed_ref or len(parsed_ref) < 3:
-        return None
-        
-    target_title = parsed_ref[2]
-    
+    # Already-normalized titles (lowercase ASCII words separated by single
+    # spaces) come back unchanged, so skip the rewrite for them
+    if (title.isascii() and title.islower() and title.replace(' ', '').isalnum()
+            and '  ' not in title and title[0] != ' ' and title[-1] != ' '):
+        return title
+    title = title.lower().translate(_TITLE_TRANS)
+    if not title.isascii():
+        title = _PUNCT_RE.sub(' ', title)
+    return ' '.join(title.split())
+
+def build_title_index(bib_database: BibDatabase) -> TitleIndex:
+    """Index BibTeX entry keys by normalized title"""
+    by_title: dict[str, str] = {}
+    by_compact: dict[str, tuple[str, str] | None] = {}
     for entry in bib_database.entries:
         if 'title' not in entry:
             continue
         bib_title = entry['title']
-        bib_title = bib_title.replace('{', '').replace('}', '')
-        bib_title = normalize_title(bib_title)
-        if bib_title == target_title:
-            return entry['ID']
-    return None
-
-def get_reference_line_by_author_year(references, first_author, year_part):
-    """Find reference line by author and year"""
-    if not references or not first_author or not year_part:
+        if '{' in bib_title or '}' in bib_title:
+            bib_title = bib_title.translate(_BRACE_STRIP)
+        # Interned keys let lookups with an interned probe succeed on identity
+        # instead of a compare
+        title = sys.intern(normalize_title(bib_title))
+        if title in by_title:
+            continue  # Keep the first entry for duplicate titles
+        by_title[title] = entry['ID']
+        compact = title.replace(' ', '')
+        # Different titles that only differ in spacing make the key ambiguous
+        by_compact[compact] = None if compact in by_compact else (entry['ID'], title)
+    return TitleIndex(by_title, by_compact)
+
+def find_fuzzy_title_key(target_title: str, title_index: TitleIndex) -> tuple[str, str] | None:
+    """Find the BibTeX key and title that differ from target_title only in
+    how words are split (dashes, apostrophes), or None if there is no single
+    such title"""
+    return title_index.by_compact.get(target_title.replace(' ', ''))
+
+def get_reference_key(reference: ParsedRef, title_index: TitleIndex) -> tuple[str | None, str | None]:
+    """Find BibTeX key for an indexed reference
+
+    Returns the key and, when it came from the fuzzy fallback, the matched
+    BibTeX title so the caller can ask the user to check it.
+    """
+    if not reference:
+        return None, None
+        
+    by_title = title_index.by_title
+    target_title = reference.title
+    if len(by_title) > _INTERN_PROBE_MIN:
+        target_title = sys.intern(target_title)
+    key = by_title.get(target_title)
+    if key is not None:
+        return key, None
+    # Dashes and apostrophes can split or join words differently on the two
+    # sides, which defeats the exact lookup
+    fuzzy_match = find_fuzzy_title_key(target_title, title_index)
+    if fuzzy_match is None:
+        return None, None
+    return fuzzy_match
+
+@functools.lru_cache(maxsize=4)
+def build_bib_index(bib_text: str) -> TitleIndex:
+    """Parse a .bib file and index it, reusing the result for repeated input"""
+    import bibtexparser  # type: ignore[import-untyped]
+    parser = bibtexparser.bparser.BibTexParser(common_strings=True)
+    return build_title_index(bibtexparser.loads(bib_text, parser=parser))
+
+@functools.lru_cache(maxsize=4)
+def build_reference_index(references: str) -> dict[tuple[str, str], ParsedRef]:
+    """Map (first author, year) pairs to parsed references, reusing the result for repeated input"""
+    reference_index: dict[tuple[str, str], ParsedRef] = {}
+    if not references:
+        return reference_index
+
+    for match in _REF_LINE_RE.finditer(references):
+        line = match.group(0).strip()
+        ref_authors = match.group('authors').strip()
+        ref_year = match.group('year')
+        ref_title = normalize_title(match.group('title'))
+        first_ref_author = sys.intern(_FIRST_AUTHOR_SEP_RE.split(ref_authors, maxsplit=1)[0].strip())
+        # Keep the first line for duplicate author/year pairs
+        reference_index.setdefault(
+            (first_ref_author, ref_year), ParsedRef(first_ref_author, ref_year, ref_title, line)
+        )
+    return reference_index
+
+def get_reference_by_author_year(
+    reference_index: dict[tuple[str, str], ParsedRef], first_author: str, year_part: str
+) -> ParsedRef | None:
+    """Find parsed reference by author and year"""
+    if not reference_index or not first_author or not year_part:
         return None
         
-    for line in references.splitlines():
-        line = line.strip()
-        if not line:
-            continue
-        parsed = parse_reference(line)
-        if len(parsed) < 2:
-            continue
-        ref_authors = parsed[0]
-        ref_year = parsed[1]
-        first_ref_author = ref_authors.split(',')[0].split('&')[0].split(' and ')[0].strip()
-        if first_ref_author == first_author and ref_year == year_part:
-            return line
-    return None
-
-def apa2tex(input_refs, input_tex, bib_text):
-    """Convert APA citations to LaTeX format"""
+    if len(reference_index) > _INTERN_PROBE_MIN:
+        first_author = sys.intern(first_author)
+    return reference_index.get((first_author, year_part))
+
+def strip_example_prefix(text: str) -> str:
+    """Remove a leading 'e.g.,' or 'i.e.,' (any case) from citation text"""
+    # Most citations have no prefix, so all they pay is a short slice compare
+    if text[:5].lower() in ('e.g.,', 'i.e.,'):
+        return text[5:].lstrip()
+    return text
+
+def extract_first_author(author_text: str) -> str:
+    """Extract the first author's name from citation author text"""
+    # Handle both escaped and unescaped ampersands
+    if 'et al.' in author_text:
+        first_author = author_text.partition('et al.')[0].partition(',')[0]
+    else:
+        # Split on ',', & and \&; only the first author is used, so stop at
+        # the first separator
+        first_author = _SPLIT_AUTHORS_RE.split(author_text, maxsplit=1)[0]
+    # Remove escaping for comparison
+    return first_author.strip().replace('\\&', '&')
+
+def replace_matches(
+    pattern: re.Pattern, text: str, replace: Callable[[re.Match], str]
+) -> str:
+    """Rebuild text in one pass, swapping each pattern match for replace(match)"""
+    parts = []
+    last_end = 0
+    for match in pattern.finditer(text):
+        parts.append(text[last_end:match.start()])
+        parts.append(replace(match))
+        last_end = match.end()
+    if not parts:
+        return text
+    parts.append(text[last_end:])
+    return ''.join(parts)
+
+class ConversionContext:
+    """State shared by the citation handlers during one conversion"""
+    __slots__ = ('title_index', 'reference_index', 'failures', 'conversion_count')
+
+    def __init__(
+        self,
+        title_index: TitleIndex,
+        reference_index: dict[tuple[str, str], ParsedRef],
+    ) -> None:
+        self.title_index = title_index
+        self.reference_index = reference_index
+        # Failed lookups are counted here and only formatted once at the end,
+        # so repeats of the same unmatched citation cost a counter bump
+        self.failures: collections.Counter[tuple[str, tuple[str, ...]]] = collections.Counter()
+        self.conversion_count = 0  # Track successful conversions
+
+    def report(self, template: str, *args: str) -> None:
+        """Record a failed or inexact lookup for the end-of-conversion summary"""
+        self.failures[(template, args)] += 1
+
+    def failure_messages(self) -> list[str]:
+        """Format each distinct failure once, in first-seen order"""
+        messages = []
+        for (template, args), count in self.failures.items():
+            message = template.format(*args)
+            if count > 1:
+                message += f" ({count} occurrences)"
+            messages.append(message)
+        return messages
+
+def process_citation(match: re.Match, ctx: ConversionContext) -> str:
+    """Convert a parenthetical citation group to \\citep"""
+    try:
+        original = match.group(0)
+        group_content = match.group('paren')
+
+        # Skip processing if content doesn't look like a citation. _CITATION_RE
+        # only matches parentheses with a year; anything convertible also has
+        # at least "A, 2020" worth of text and a comma
+        if len(group_content) < 6 or ',' not in group_content:
+            return original
+
+        group_content = strip_example_prefix(group_content)
+        citations = [c.strip() for c in group_content.split(';')]
+        keys = []
+
+        for citation in citations:
+            # Skip if doesn't look like a citation (no year pattern)
+            if not _CITE_TRAIL_RE.search(citation):
+                continue
+                
+            citation = strip_example_prefix(citation).strip()
+            # Update regex to handle escaped ampersands
+            citation_match = _CITE_RE.match(citation)
+            if not citation_match:
+                continue
+                
+            author_part, year_part = citation_match.groups()
+
+            first_author = extract_first_author(author_part)
+            if not first_author and 'et al.' not in author_part:
+                continue
+
+            reference = get_reference_by_author_year(ctx.reference_index, first_author, year_part)
+            if not reference:
+                ctx.report("Reference not found for {}", citation)
+                continue
+
+            key, fuzzy_title = get_reference_key(reference, ctx.title_index)
+            if not key:
+                ctx.report("Key not found for {}", citation)
+                continue
+            if fuzzy_title:
+                ctx.report("Inexact title match for {}: used {} ({}), please check", citation, key, fuzzy_title)
+                
+            keys.append(key)
+
+        # If we have at least one valid key
+        if keys:
+            ctx.conversion_count += len(keys)
+            prefix = 'e.g., ' if 'e.g.' in original.lower() else ''
+            return f'({prefix}\\citep{{{",".join(keys)}}})'
+        else:
+            # Return original if no keys found
+            return original
+            
+    except Exception as e:
+        return match.group(0)
+
+def process_textual_citation(match: re.Match, ctx: ConversionContext) -> str:
+    """Convert a textual citation to \\citet"""
+    try:
+        authors_text = match.group('authors').strip()
+        year_text = match.group('year')
+        
+        first_author = extract_first_author(authors_text)
+        
+        reference = get_reference_by_author_year(ctx.reference_index, first_author, year_text)
+        if not reference:
+            ctx.report("Textual reference not found for {} ({})", authors_text, year_text)
+            return match.group(0)
+        
+        key, fuzzy_title = get_reference_key(reference, ctx.title_index)
+        if key:
+            if fuzzy_title:
+                ctx.report("Inexact title match for textual citation: {} ({}): used {} ({}), please check",
+                           authors_text, year_text, key, fuzzy_title)
+            ctx.conversion_count += 1
+            # Preserve original escaping in output
+            output = f'{match.group("lead")}\\citet{{{key}}}'
+            # Restore ampersand escaping if it existed in original
+            if '\\&' in authors_text:
+                output = output.replace(' & ', ' \\& ')
+            return output
+        else:
+            ctx.report("Key not found for textual citation: {} ({})", authors_text, year_text)
+            return match.group(0)
+            
+    except Exception as e:
+        return match.group(0)
+
+def process_match(ctx: ConversionContext, match: re.Match) -> str:
+    """Dispatch a _CITATION_RE match to the matching handler"""
+    # ctx comes first so apa2tex can bind it positionally with
+    # functools.partial; a keyword binding is several times slower per call
+    kind = match.lastgroup
+    if kind == 'amp':
+        return ' \\& '
+    if kind == 'paren':
+        output = process_citation(match, ctx)
+    else:
+        output = process_textual_citation(match, ctx)
+    # Unconverted text is returned as-is and may still hold a bare ' & '
+    return output.replace(' & ', ' \\& ')
+
+def apa2tex(input_refs: str, input_tex: str, bib_text: str, emit_messages: bool = True) -> dict:
+    """Convert APA citations to LaTeX format
+
+    With emit_messages=False the per-citation failure diagnostics are never
+    formatted; only the summary message is returned.
+    """
     messages = []
     original_tex = input_tex
-    conversion_count = 0  # Track successful conversions
-    
+
+    # Both citation forms need a parenthesis. Without one there is nothing to
+    # look up, so skip parsing the .bib and references and only escape
+    # ampersands
+    if '(' not in input_tex:
+        messages.append(_NO_CONVERSIONS_MESSAGE)
+        return {"output": input_tex.replace(' & ', ' \\& '), "messages": messages}
+
     try:
-        import bibtexparser
-        from bibtexparser.bibdatabase import BibDatabase
-        parser = bibtexparser.bparser.BibTexParser(common_strings=True)
-        bib_database = bibtexparser.loads(bib_text, parser=parser)
+        title_index = build_bib_index(bib_text)
     except Exception as e:
         messages.append(f"Error parsing BibTeX file: {str(e)}")
         return {"output": original_tex, "messages": messages}
 
-    def process_citation(match):
-        nonlocal messages, conversion_count
-        try:
-            original = match.group(0)
-            group_content = match.group(1)
-
-            # Skip processing if content doesn't look like a citation
-            if not re.search(r'\d{4}[a-z]?', group_content):
-                return original
-
-            group_content = re.sub(r'^(e\.g\.,|i\.e\.,)\s*', '', group_content, flags=re.IGNORECASE)
-            citations = [c.strip() for c in group_content.split(';')]
-            keys = []
-            valid = True
-            processed_citations = []
-
-            for citation in citations:
-                # Skip if doesn't look like a citation (no year pattern)
-                if not re.search(r',\s*\d{4}[a-z]?$', citation):
-                    processed_citations.append(citation)
-                    continue
-                    
-                citation = re.sub(r'^(e\.g\.,|i\.e\.,)\s*', '', citation, flags=re.IGNORECASE).strip()
-                # Update regex to handle escaped ampersands
-                citation_match = re.match(r'^(.*?),\s*(\d{4}[a-z]?)$', citation)
-                if not citation_match:
-                    processed_citations.append(citation)
-                    continue
-                    
-                author_part, year_part = citation_match.groups()
-
-                # Handle both escaped and unescaped ampersands
-                if 'et al.' in author_part:
-                    # Remove escaping for comparison
-                    first_author = author_part.split('et al.')[0].split(',')[0].strip().replace('\\&', '&')
-                else:
-                    # Split on both & and \&
-                    authors = re.split(r', | & | \\& | and ', author_part)
-                    first_author = authors[0].split(',')[0].strip().replace('\\&', '&') if authors and len(authors) > 0 else ''
-                    if not first_author:
-                        processed_citations.append(citation)
-                        continue
-
-                reference_line = get_reference_line_by_author_year(input_refs, first_author, year_part)
-                if not reference_line:
-                    messages.append(f"Reference not found for {citation}")
-                    processed_citations.append(citation)
-                    continue
-
-                key = get_reference_key(reference_line, bib_database)
-                if not key:
-                    messages.append(f"Key not found for {citation}")
-                    processed_citations.append(citation)
-                    continue
-                    
-                keys.append(key)
-                processed_citations.append(None)  # Mark as successfully processed
-
-            # If we have at least one valid key
-            if keys:
-                conversion_count += len(keys)
-                prefix = 'e.g., ' if 'e.g.' in original.lower() else ''
-                return f'({prefix}\\citep{{{",".join(keys)}}})'
-            else:
-                # Return original if no keys found
-                return original
-                
-        except Exception as e:
-            return match.group(0)
-
-    def process_textual_citation(match):
-        nonlocal messages, conversion_count
-        try:
-            authors_text = match.group(1).strip()
-            year_text = match.group(2)
-            
-            # Handle both escaped and unescaped ampersands
-            if 'et al.' in authors_text:
-                # Remove escaping for comparison
-                first_author = authors_text.split('et al.')[0].split(',')[0].strip().replace('\\&', '&')
-            else:
-                # Split on both & and \&
-                authors_split = re.split(r', | & | \\& | and ', authors_text)
-                first_author = authors_split[0].split(',')[0].strip().replace('\\&', '&') if authors_split and len(authors_split) > 0 else ''
-            
-            reference_line = get_reference_line_by_author_year(input_refs, first_author, year_text)
-            if not reference_line:
-                messages.append(f"Textual reference not found for {authors_text} ({year_text})")
-                return match.group(0)
-            
-            key = get_reference_key(reference_line, bib_database)
-            if key:
-                conversion_count += 1
-                # Preserve original escaping in output
-                output = f'\\citet{{{key}}}'
-                # Restore ampersand escaping if it existed in original
-                if '\\&' in authors_text:
-                    output = output.replace(' & ', ' \\& ')
-                return output
-            else:
-                messages.append(f"Key not found for textual citation: {authors_text} ({year_text})")
-                return match.group(0)
-                
-        except Exception as e:
-            return match.group(0)
+    ctx = ConversionContext(title_index, build_reference_index(input_refs))
 
     try:
-        # First handle textual citations (Author (Year))
-        converted_tex = re.sub(
-            r'(\b[\w\s,&]+?(?:\s+et al\.?)?)\s+\((\d{4}[a-z]?)\)',
-            process_textual_citation,
-            input_tex
+        converted_tex = replace_matches(
+            _CITATION_RE, input_tex, functools.partial(process_match, ctx)
         )
-        # Then handle parenthetical citations ((Author, Year; Author2, Year))
-        converted_tex = re.sub(r'\(([^)]+)\)', process_citation, converted_tex)
-        
-        # Preserve existing ampersand escaping in the rest of the document
-        converted_tex = converted_tex.replace(' & ', ' \\& ')
+        if emit_messages:
+            messages.extend(ctx.failure_messages())
         
         # Add success message if conversions occurred
-        if conversion_count > 0:
+        if ctx.conversion_count > 0:
             support_message = (
-                f"✅ Successfully converted {conversion_count} citations. "
+                f"✅ Successfully converted {ctx.conversion_count} citations. "
                 "If you find this ad-free website helpful, please consider "
                 "supporting us at <a href='https://coff.ee/orangemeowmeow' "
                 "target='_blank'>coff.ee/orangemeowmeow</a>! ❤️"
             )
             messages.insert(0, support_message)
         else:
-            messages.insert(0, "⚠️ No citations were converted. Please check your input formats")
+            messages.insert(0, _NO_CONVERSIONS_MESSAGE)
             
         return {"output": converted_tex, "messages": messages}
         
@@ -223,7 +395,7 @@ def apa2tex(input_refs, input_tex, bib_text):
         messages.append(f"Conversion error: {str(e)}")
         return {"output": original_tex, "messages": messages}
         
-def main(refs_text, tex_text, bib_text):
+def main(refs_text: str, tex_text: str, bib_text: str) -> tuple[str, str]:
     """Main conversion function"""
     try:
         result = apa2tex(refs_text, tex_text, bib_text)
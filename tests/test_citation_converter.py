@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'docs'))
+
+import citation_converter as cc
+
+
+def make_index(*titles):
+    entries = [{'ID': f'key{i}', 'title': title} for i, title in enumerate(titles)]
+    return cc.build_title_index(SimpleNamespace(entries=entries))
+
+
+def fuzzy_key(reference_title, *bib_titles):
+    match = cc.find_fuzzy_title_key(cc.normalize_title(reference_title), make_index(*bib_titles))
+    return match and match[0]
+
+
+def test_fuzzy_recovers_dash_difference():
+    assert fuzzy_key('Email spam filtering', 'E-mail Spam Filtering') == 'key0'
+    assert fuzzy_key('Co-operation in groups', 'Cooperation in Groups') == 'key0'
+
+
+def test_fuzzy_recovers_apostrophe_difference():
+    assert fuzzy_key("Childrens' play", "Children's Play") == 'key0'
+
+
+def test_fuzzy_rejects_extra_word():
+    assert fuzzy_key('Attention is all you need', 'Attention Is Not All You Need') is None
+    assert fuzzy_key('Graph theory', 'Graph theory extra') is None
+    assert fuzzy_key('Graph theory extra', 'Graph theory') is None
+
+
+def test_fuzzy_rejects_ambiguous_candidates():
+    assert fuzzy_key('Email spam', 'E-mail Spam', 'Emai-l Spam') is None
+
+
+def test_fuzzy_rejects_anagrams_and_reordered_words():
+    assert fuzzy_key('United interests', 'Untied Interests') is None
+    assert fuzzy_key('The silent night', 'The Listen Night') is None
+    assert fuzzy_key('ab cd ef', 'cdab ef') is None
+    assert fuzzy_key('Learning deep models', 'Deep learning models') is None
+
+
+def test_fuzzy_match_is_reported():
+    bib = '@article{mail, title={E-mail Spam Filtering}, author={Jones, B.}, year={2019}}\n'
+    refs = 'Jones, B. (2019). Email spam filtering. Journal.\n'
+    result = cc.apa2tex(refs, 'As shown (Jones, 2019).', bib)
+    assert result['output'] == 'As shown (\\citep{mail}).'
+    assert any('Inexact title match for Jones, 2019' in m and 'e mail spam filtering' in m
+               for m in result['messages'])
+
+
+def test_anagram_title_is_not_converted():
+    bib = '@article{k, title={Untied Interests}, author={Roe, A.}, year={2010}}\n'
+    result = cc.apa2tex('Roe, A. (2010). United interests. J.\n', 'As argued (Roe, 2010).', bib)
+    assert result['output'] == 'As argued (Roe, 2010).'
+
+
+def test_extra_word_is_not_converted():
+    bib = '@article{vaswani, title={Attention Is Not All You Need}, author={X}, year={2017}}\n'
+    refs = 'Smith, A. (2017). Attention is all you need. Journal.\n'
+    result = cc.apa2tex(refs, 'As shown (Smith, 2017).', bib)
+    assert result['output'] == 'As shown (Smith, 2017).'
+    assert 'Key not found for Smith, 2017' in result['messages']
+
+
+def test_unclosed_parenthesis_before_years_is_linear():
+    text = '(' + 'in 2020 we saw that ' * 20000
+    start = time.perf_counter()
+    result = cc.apa2tex('Smith, A. (2020). Title. Journal.\n', text, '')
+    assert time.perf_counter() - start < 1
+    assert result['output'] == text
+
+
+CITATION_BIB = (
+    '@article{smith, title={Graph Theory}, author={Smith, A.}, year={2020}}\n'
+    '@article{lee, title={Deep Nets}, author={Lee, B.}, year={2019}}\n'
+)
+CITATION_REFS = (
+    'Smith, A. (2020). Graph theory. Journal.\n'
+    'Lee, B., Kim, C., & Park, D. (2019). Deep nets. Journal.\n'
+)
+
+
+def convert(text):
+    return cc.apa2tex(CITATION_REFS, text, CITATION_BIB)['output']
+
+
+def test_textual_citation_keeps_leading_separators():
+    assert convert('As noted. , Smith (2020) found') == 'As noted. , \\citet{smith} found'
+
+
+def test_textual_et_al_citation_converts():
+    assert convert('Lee et al. (2019) showed') == '\\citet{lee} showed'
+    assert convert('Lee, Kim, & Park (2019) showed') == '\\citet{lee} showed'
+
+
+def test_bare_ampersand_is_escaped():
+    assert convert('Tom & Jerry met (Lee et al., 2019).') == 'Tom \\& Jerry met (\\citep{lee}).'
+    assert convert('Tom & Jerry (no citation)') == 'Tom \\& Jerry (no citation)'
+
+
+def test_long_author_like_run_is_linear():
+    text = 'Smith and ' * 20000 + '. Smith (2020)'
+    start = time.perf_counter()
+    result = convert(text)
+    assert time.perf_counter() - start < 1
+    assert result == 'Smith and ' * 20000 + '. \\citet{smith}'